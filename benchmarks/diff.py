@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Worst-case timings for ``comments_extension.diff.diff_comment``.
+
+Every input is close to COMMENT_MAX_LENGTH (3000) characters. Each case is
+diffed with the default time budget and without any budget, so the output
+shows both how long the unbounded diff would take and where the budget cuts
+it off. Run from the repository root with django-contrib-comments installed:
+
+    $ python benchmarks/diff.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.path.pardir))
+
+from django.conf import settings
+settings.configure()
+
+from comments_extension.diff import diff_comment, DEFAULT_DIFF_TIMEOUT
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+
+
+def text_of_words(count):
+    return " ".join(WORDS[(i * 7 + i // 3) % len(WORDS)] for i in range(count))
+
+
+def edit_every(text, step):
+    words = text.split(" ")
+    for i in range(0, len(words), step):
+        words[i] = "edited"
+    return " ".join(words)
+
+
+PROSE = text_of_words(500)[:3000]
+
+CASES = [
+    ("disjoint single letters", " ".join(["a"] * 1500), " ".join(["b"] * 1500)),
+    ("digits i % 10 vs i % 7", " ".join(str(i % 10) for i in range(1500)),
+     " ".join(str(i % 7) for i in range(1500))),
+    ("swapped word pairs", " ".join(["a", "b"] * 750), " ".join(["b", "a"] * 750)),
+    ("prose, every 5th word edited", PROSE, edit_every(PROSE, 5)),
+    ("prose, every 10th word edited", PROSE, edit_every(PROSE, 10)),
+    ("prose, every 25th word edited", PROSE, edit_every(PROSE, 25)),
+]
+
+
+def measure(original, edited, timeout):
+    start = time.time()
+    diff = diff_comment(original, edited, timeout=timeout, max_tokens=10 ** 6)
+    return diff, time.time() - start
+
+
+if __name__ == "__main__":
+    print("%-32s %22s %12s" % ("input", "%d ms budget" % (DEFAULT_DIFF_TIMEOUT * 1000), "unbounded"))
+    for name, original, edited in CASES:
+        diff, bounded = measure(original, edited, DEFAULT_DIFF_TIMEOUT)
+        unbounded = measure(original, edited, 3600)[1]
+        print("%-32s %8s %12.4fs %11.4fs" % (
+            name, "changed" if diff is None else "diff", bounded, unbounded))
@@ -0,0 +1,271 @@
+"""
+Read-through cache of comment instances for the edit and preview cycle.
+
+The cache is off unless ``COMMENTS_EXTENSION_OBJECT_CACHE_SIZE`` is set to the
+number of comments to keep in a small in-process LRU. If
+``COMMENTS_EXTENSION_OBJECT_CACHE_ALIAS`` names one of the ``CACHES``,
+comments are kept in that shared Django cache as well.
+
+Every comment has a version stamp which is dropped whenever the comment is
+saved or deleted, and again when the transaction commits, so the next reader
+gets a fresh stamp. Cached instances remember the stamp they were loaded
+under, so an entry is only served while its stamp is current. Without a
+shared cache the stamps are local to the process, so the shared cache should
+be configured whenever comments are saved by more than one process. Before
+Django 1.9 there is no commit hook, so the stamp is only dropped when the
+comment is saved.
+
+The cache is only meant for reads. Comments which are about to be saved
+should be read with ``for_update``, which always locks and reads the row
+from the database.
+"""
+from __future__ import absolute_import
+
+import copy
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+from django.http import Http404
+
+try:
+    from django.core.cache import caches
+
+    def get_cache(alias):
+        return caches[alias]
+except ImportError:
+    from django.core.cache import get_cache
+
+try:
+    from django.db.transaction import on_commit
+except ImportError:
+    on_commit = None
+
+# Try to import django_comments otherwise fallback to the django contrib comments
+try:
+    from django_comments import get_model
+except ImportError:
+    try:
+        from django.contrib.comments import get_model
+    except ImportError:
+        raise ImportError('django-comments-extension requires django-contrib-comments to be installed or the deprecated'
+                          ' (as of django 1.6) django.contrib.comments.')
+
+
+DEFAULT_OBJECT_CACHE_SIZE = 0
+VERSION_ATTR = "_comments_extension_version"
+
+
+class CommentObjectCache(object):
+    """
+    Version-stamped read-through cache of comment instances.
+    """
+    key_prefix = "comments_extension.comment"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._objects = OrderedDict()
+        self._versions = OrderedDict()
+
+    @property
+    def size(self):
+        return getattr(settings, "COMMENTS_EXTENSION_OBJECT_CACHE_SIZE", DEFAULT_OBJECT_CACHE_SIZE)
+
+    @property
+    def shared(self):
+        alias = getattr(settings, "COMMENTS_EXTENSION_OBJECT_CACHE_ALIAS", None)
+        return get_cache(alias) if alias else None
+
+    def object_key(self, pk):
+        return "%s.%s" % (self.key_prefix, pk)
+
+    def version_key(self, pk):
+        return "%s.%s.version" % (self.key_prefix, pk)
+
+    def peek_version(self, pk):
+        """
+        Return the known version stamp of comment ``pk``, or ``None`` if
+        there is none, either because the comment was invalidated or
+        because its stamp was evicted.
+        """
+        pk = str(pk)
+        shared = self.shared
+        if shared is not None:
+            version = shared.get(self.version_key(pk))
+            if version is not None:
+                return version
+        with self._lock:
+            return self._versions.get(pk)
+
+    def get_version(self, pk):
+        """
+        Return the current version stamp of comment ``pk``, creating one if
+        there is none.
+        """
+        pk = str(pk)
+        shared = self.shared
+        if shared is not None:
+            version = shared.get(self.version_key(pk))
+            if version is None:
+                # Use add() so concurrent readers agree on the same stamp
+                shared.add(self.version_key(pk), uuid.uuid4().hex, None)
+                version = shared.get(self.version_key(pk))
+            if version is not None:
+                return version
+        # No shared cache, or it is unavailable. Stamps are kept for as many
+        # comments as the LRU, an evicted stamp only costs a cache miss.
+        with self._lock:
+            version = self._versions.pop(pk, None) or uuid.uuid4().hex
+            self._versions[pk] = version
+            while len(self._versions) > max(self.size, 1):
+                self._versions.popitem(last=False)
+            return version
+
+    def is_current(self, comment):
+        """
+        Check that an unmodified ``comment`` copy is still current. Instances
+        which did not come from the cache are always current.
+
+        If there is no known stamp to compare with, the copy is compared
+        with the database instead.
+        """
+        version = getattr(comment, VERSION_ATTR, None)
+        if version is None:
+            return True
+        current = self.peek_version(comment.pk)
+        if current is not None:
+            return version == current
+        try:
+            return self.same_row(comment, self.load(comment.pk))
+        except get_model().DoesNotExist:
+            return False
+
+    def same_row(self, comment, other):
+        """
+        Check that two instances of a comment have the same field values.
+        """
+        return all(getattr(comment, f.attname) == getattr(other, f.attname)
+                   for f in comment._meta.fields)
+
+    def get(self, pk, site_id=None, for_update=False):
+        """
+        Return a private copy of comment ``pk``, loading it from the database
+        if there is no current cached copy. If ``site_id`` is given, the
+        comment must belong to that site. If ``for_update`` is set, the
+        comment is always loaded from the database with ``select_for_update``,
+        which must be called within a transaction.
+
+        Raises the comment model's ``DoesNotExist`` if there is no such comment.
+        """
+        if for_update or self.size <= 0:
+            comment = self.load(pk, for_update=for_update)
+        else:
+            comment = self.get_cached(pk)
+
+        # Comments are cached regardless of site, so check it here
+        if site_id is not None and str(comment.site_id) != str(site_id):
+            raise get_model().DoesNotExist
+        return comment
+
+    def get_cached(self, pk):
+        """
+        Return a private copy of comment ``pk`` from the LRU, the shared
+        cache or the database, in that order.
+        """
+        # Read the version before loading, so a concurrent save
+        # makes the loaded instance stale rather than current.
+        version = self.get_version(pk)
+        key = self.object_key(pk)
+
+        with self._lock:
+            entry = self._objects.get(key)
+            if entry is not None:
+                if entry[0] == version:
+                    self._objects[key] = self._objects.pop(key)
+                    return copy.deepcopy(entry[1])
+                del self._objects[key]
+
+        shared = self.shared
+        entry = shared.get(key) if shared is not None else None
+        if entry is None or entry[0] != version:
+            comment = self.load(pk)
+            setattr(comment, VERSION_ATTR, version)
+            entry = (version, comment)
+            if shared is not None:
+                shared.set(key, entry)
+
+        self.store(key, entry)
+        return copy.deepcopy(entry[1])
+
+    def load(self, pk, for_update=False):
+        """
+        Load comment ``pk`` along with its content type and user.
+        """
+        queryset = get_model().objects.select_related("content_type", "user")
+        if for_update:
+            queryset = queryset.select_for_update()
+        return queryset.get(pk=pk)
+
+    def store(self, key, entry):
+        with self._lock:
+            self._objects.pop(key, None)
+            self._objects[key] = entry
+            while len(self._objects) > self.size:
+                self._objects.popitem(last=False)
+
+    def invalidate(self, pk):
+        """
+        Drop the version stamp of comment ``pk``. The next reader gets a
+        fresh stamp, which makes every cached copy of it stale.
+        """
+        if self.size <= 0:
+            return
+        pk = str(pk)
+        with self._lock:
+            self._versions.pop(pk, None)
+            self._objects.pop(self.object_key(pk), None)
+        shared = self.shared
+        if shared is not None:
+            shared.delete(self.version_key(pk))
+
+    def clear(self):
+        with self._lock:
+            self._objects.clear()
+            self._versions.clear()
+
+
+comment_cache = CommentObjectCache()
+
+
+def get_comment_or_404(pk, site_id=None, for_update=False):
+    """
+    Like ``get_object_or_404``, but reads the comment through ``comment_cache``.
+    """
+    try:
+        return comment_cache.get(pk, site_id, for_update)
+    except get_model().DoesNotExist:
+        raise Http404("No comment matches the given query.")
+
+
+def invalidate_comment(sender, instance, **kwargs):
+    """
+    Signal handler which invalidates a comment when it is saved or deleted.
+
+    The signal fires before the transaction commits, and meanwhile another
+    process may cache the old row under a fresh stamp. So the stamp is
+    dropped once more when the transaction commits.
+    """
+    if comment_cache.size <= 0:
+        return
+    pk = instance.pk
+    comment_cache.invalidate(pk)
+    if on_commit is not None:
+        on_commit(lambda: comment_cache.invalidate(pk))
+
+
+post_save.connect(invalidate_comment, sender=get_model(),
+                  dispatch_uid="comments_extension.cache.post_save")
+post_delete.connect(invalidate_comment, sender=get_model(),
+                    dispatch_uid="comments_extension.cache.post_delete")
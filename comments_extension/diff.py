@@ -0,0 +1,209 @@
+"""
+Bounded-time word diff used by the comment edit preview.
+
+The diff is computed with Myers' linear-space (middle snake) algorithm on
+word tokens rather than characters, which keeps the sequences short. Because
+the worst case is still O((N + M) * D), every diff runs under a time budget
+and a size budget. When either budget runs out the diff is abandoned and
+``None`` is returned, so callers can fall back to simply saying the comment
+has "changed".
+"""
+from __future__ import absolute_import
+
+import re
+import time
+
+from django.conf import settings
+
+
+DIFF_EQUAL = "equal"
+DIFF_DELETE = "delete"
+DIFF_INSERT = "insert"
+
+# Words and the whitespace between them are kept as separate tokens,
+# so joining the tokens back together reproduces the original text.
+TOKEN_RE = re.compile(r"\s+|[^\s]+", re.UNICODE)
+
+DEFAULT_DIFF_TIMEOUT = 0.05
+# Enough for two comments of COMMENT_MAX_LENGTH (3000) characters each
+DEFAULT_DIFF_MAX_TOKENS = 6000
+
+
+class DiffBudgetExceeded(Exception):
+    """
+    Raised internally when a diff runs out of its time or size budget.
+    """
+    pass
+
+
+def tokenize(text):
+    """
+    Split ``text`` into word and whitespace tokens.
+    """
+    return TOKEN_RE.findall(text)
+
+
+def diff_comment(original, edited, timeout=None, max_tokens=None):
+    """
+    Return a list of ``(op, text)`` chunks describing how to turn ``original``
+    into ``edited``, where ``op`` is one of ``DIFF_EQUAL``, ``DIFF_DELETE``
+    or ``DIFF_INSERT``.
+
+    Returns ``None`` if the diff could not be computed within ``timeout``
+    seconds (``COMMENTS_EXTENSION_DIFF_TIMEOUT``), or if the two texts
+    together contain more than ``max_tokens`` tokens
+    (``COMMENTS_EXTENSION_DIFF_MAX_TOKENS``).
+    """
+    if timeout is None:
+        timeout = getattr(settings, "COMMENTS_EXTENSION_DIFF_TIMEOUT", DEFAULT_DIFF_TIMEOUT)
+    if max_tokens is None:
+        max_tokens = getattr(settings, "COMMENTS_EXTENSION_DIFF_MAX_TOKENS", DEFAULT_DIFF_MAX_TOKENS)
+
+    if original == edited:
+        return [(DIFF_EQUAL, original)] if original else []
+
+    original_tokens, edited_tokens = tokenize(original), tokenize(edited)
+    if len(original_tokens) + len(edited_tokens) > max_tokens:
+        return None
+
+    # Compare integers instead of strings in the inner loops
+    token_ids = {}
+    a = [token_ids.setdefault(t, len(token_ids)) for t in original_tokens]
+    b = [token_ids.setdefault(t, len(token_ids)) for t in edited_tokens]
+    words = dict((v, k) for k, v in token_ids.items())
+
+    try:
+        chunks = _diff(a, b, time.time() + timeout)
+    except DiffBudgetExceeded:
+        return None
+
+    # Merge adjacent chunks with the same operation and turn the
+    # token ids back into text.
+    diff = []
+    for op, tokens in chunks:
+        if not tokens:
+            continue
+        text = "".join(words[t] for t in tokens)
+        if diff and diff[-1][0] == op:
+            diff[-1] = (op, diff[-1][1] + text)
+        else:
+            diff.append((op, text))
+    return diff
+
+
+def _diff(a, b, deadline):
+    """
+    Diff two token sequences, stripping any common prefix and suffix
+    before handing the rest over to ``_bisect``.
+    """
+    if a == b:
+        return [(DIFF_EQUAL, a)]
+
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and a[-suffix - 1] == b[-suffix - 1]:
+        suffix += 1
+
+    a_middle = a[prefix:len(a) - suffix]
+    b_middle = b[prefix:len(b) - suffix]
+
+    if not a_middle:
+        chunks = [(DIFF_INSERT, b_middle)]
+    elif not b_middle:
+        chunks = [(DIFF_DELETE, a_middle)]
+    else:
+        chunks = _bisect(a_middle, b_middle, deadline)
+
+    return [(DIFF_EQUAL, a[:prefix])] + chunks + [(DIFF_EQUAL, a[len(a) - suffix:])]
+
+
+def _bisect(a, b, deadline):
+    """
+    Find the middle snake of ``a`` and ``b`` and recursively diff the two
+    halves around it. Only the two frontier vectors are kept in memory, so
+    space is linear in the input size.
+    """
+    n, m = len(a), len(b)
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    # If the total number of tokens is odd, the front path will
+    # collide with the reverse path.
+    front = delta % 2 != 0
+    # Offsets for the start and end of the k loops, which prevent
+    # mapping of space beyond the grid.
+    k1start = k1end = k2start = k2end = 0
+
+    for d in range(max_d):
+        if time.time() > deadline:
+            raise DiffBudgetExceeded
+
+        # Walk the front path one step
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[x1] == b[y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    # Mirror x2 onto the top-left coordinate system
+                    x2 = n - v2[k2_offset]
+                    if x1 >= x2:
+                        return _bisect_split(a, b, x1, y1, deadline)
+
+        # Walk the reverse path one step
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[n - x2 - 1] == b[m - y2 - 1]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    # Mirror x2 onto the top-left coordinate system
+                    x2 = n - x2
+                    if x1 >= x2:
+                        return _bisect_split(a, b, x1, y1, deadline)
+
+    # The sequences have nothing in common
+    return [(DIFF_DELETE, a), (DIFF_INSERT, b)]
+
+
+def _bisect_split(a, b, x, y, deadline):
+    """
+    Diff the two halves on either side of the middle snake at ``(x, y)``.
+    """
+    return _diff(a[:x], b[:y], deadline) + _diff(a[x:], b[y:], deadline)
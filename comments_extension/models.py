@@ -1,3 +1,4 @@
 from django.db import models
 
-# Create your models here.
+# Register the signal handlers which keep the comment object cache fresh
+import comments_extension.cache
@@ -0,0 +1,291 @@
+"""
+Opt-in sampling profiler for the comments_extension views and template tags.
+
+Nothing is profiled unless ``COMMENTS_EXTENSION_PROFILE_DIR`` is set, and
+either ``COMMENTS_EXTENSION_PROFILE_RATE`` is set to a fraction between 0 and 1,
+or ``COMMENTS_EXTENSION_PROFILE_HEADER`` names a request header (as found in
+``request.META``, e.g. ``"HTTP_X_COMMENTS_PROFILE"``) that carries a token
+from ``make_profile_token``.
+
+Profiled calls are written as cProfile ``.prof`` files to
+``COMMENTS_EXTENSION_PROFILE_DIR``, keeping at most
+``COMMENTS_EXTENSION_PROFILE_KEEP`` of the files written by this module. Each
+file name is tagged with the comment id, the content type of the commented
+object and the number of queries executed, and can be inspected with
+``python -m pstats``.
+"""
+from __future__ import absolute_import
+
+import cProfile
+import glob
+import logging
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+
+# Try to import django_comments otherwise fallback to the django contrib comments
+try:
+    from django_comments import get_model
+except ImportError:
+    try:
+        from django.contrib.comments import get_model
+    except ImportError:
+        raise ImportError('django-comments-extension requires django-contrib-comments to be installed or the deprecated'
+                          ' (as of django 1.6) django.contrib.comments.')
+
+
+logger = logging.getLogger("comments_extension.profiling")
+
+PROFILE_TOKEN_SALT = "comments_extension.profiling"
+PROFILE_TOKEN_VALUE = "profile"
+
+PROFILE_PREFIX = "comments_extension-"
+
+DEFAULT_PROFILE_KEEP = 100
+DEFAULT_PROFILE_TOKEN_MAX_AGE = 60 * 60
+
+# Template tags rendered from within a profiled view are part of the view's
+# profile, and calls in other threads are not profiled while it runs.
+_state = threading.local()
+_profile_lock = threading.Lock()
+
+
+class CountingCursor(object):
+    """
+    Cursor wrapper which counts the queries executed through it.
+    """
+    def __init__(self, cursor, counter):
+        self.cursor = cursor
+        self.counter = counter
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self.counter.count += 1
+        return self.cursor.executemany(*args, **kwargs)
+
+
+class QueryCounter(object):
+    """
+    Context manager counting the queries executed on ``connection``, without
+    recording them the way the debug cursor does.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def execute(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def cursor(self):
+        return CountingCursor(self.connection_cursor(), self)
+
+    def __enter__(self):
+        if hasattr(self.connection, "execute_wrapper"):
+            # Django 2.0 and later
+            self.wrapper = self.connection.execute_wrapper(self.execute)
+            self.wrapper.__enter__()
+        else:
+            self.wrapper = None
+            self.connection_cursor = self.connection.cursor
+            self.connection.cursor = self.cursor
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.wrapper is not None:
+            self.wrapper.__exit__(exc_type, exc_value, traceback)
+        else:
+            del self.connection.cursor
+
+
+def make_profile_token():
+    """
+    Return a signed token which forces profiling of a request when sent
+    in the ``COMMENTS_EXTENSION_PROFILE_HEADER`` header.
+    """
+    return signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).sign(PROFILE_TOKEN_VALUE)
+
+
+def has_profile_token(request):
+    """
+    Check whether ``request`` carries a valid, unexpired profile token.
+    """
+    header = getattr(settings, "COMMENTS_EXTENSION_PROFILE_HEADER", None)
+    if not header or request is None or header not in request.META:
+        return False
+    max_age = getattr(settings, "COMMENTS_EXTENSION_PROFILE_TOKEN_MAX_AGE",
+                      DEFAULT_PROFILE_TOKEN_MAX_AGE)
+    try:
+        value = signing.TimestampSigner(salt=PROFILE_TOKEN_SALT).unsign(
+            request.META[header], max_age=max_age)
+    except signing.BadSignature:
+        return False
+    return value == PROFILE_TOKEN_VALUE
+
+
+def should_profile(request=None):
+    """
+    Decide whether the current call should be profiled.
+    """
+    if getattr(_state, "active", False):
+        return False
+    if not getattr(settings, "COMMENTS_EXTENSION_PROFILE_DIR", None):
+        return False
+    if has_profile_token(request):
+        return True
+    rate = getattr(settings, "COMMENTS_EXTENSION_PROFILE_RATE", 0)
+    return rate > 0 and random.random() < rate
+
+
+def run_profiled(name, get_tags, func, *args, **kwargs):
+    """
+    Call ``func`` under cProfile and dump the profile afterwards.
+    ``get_tags`` is called once profiling has stopped, and should return
+    a ``(comment_id, content_type)`` tuple used to tag the profile.
+
+    If another call is already being profiled, or another profiling tool
+    is active, ``func`` is called without profiling.
+    """
+    # Python 3.12 and later only allow one enabled profiler per process
+    if not _profile_lock.acquire(False):
+        return func(*args, **kwargs)
+
+    profiler = cProfile.Profile()
+    queries = QueryCounter(connection)
+    _state.active = True
+    try:
+        with queries:
+            try:
+                profiler.enable()
+            except ValueError:
+                profiler = None
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.disable()
+    finally:
+        _state.active = False
+        _profile_lock.release()
+        if profiler is not None:
+            try:
+                comment_id, content_type = get_tags()
+            except Exception:
+                comment_id, content_type = None, None
+            dump_profile(profiler, name, comment_id, content_type, len(queries))
+
+
+def dump_profile(profiler, name, comment_id, content_type, query_count):
+    """
+    Write ``profiler`` stats to the profile directory and prune old files.
+    Failing to write a profile never breaks the profiled request.
+    """
+    directory = settings.COMMENTS_EXTENSION_PROFILE_DIR
+    filename = "%s%s-%s-comment%s-%s-q%d-%s.prof" % (
+        PROFILE_PREFIX, time.strftime("%Y%m%d%H%M%S"), name, comment_id,
+        content_type or "unknown", query_count, uuid.uuid4().hex[:8]
+    )
+    filename = re.sub(r"[^\w.-]", "_", filename)
+    try:
+        if not os.path.isdir(directory):
+            # Profiles reveal code paths and data, keep them private
+            os.makedirs(directory, 0o700)
+        profiler.dump_stats(os.path.join(directory, filename))
+        prune_profiles(directory)
+    except (IOError, OSError):
+        logger.exception("Could not write profile %s to %s", filename, directory)
+
+
+def prune_profiles(directory, keep=None):
+    """
+    Remove the oldest profiles written by this module in ``directory``,
+    keeping at most ``keep`` (``COMMENTS_EXTENSION_PROFILE_KEEP``) files.
+    Other files in ``directory`` are left alone.
+    """
+    if keep is None:
+        keep = getattr(settings, "COMMENTS_EXTENSION_PROFILE_KEEP", DEFAULT_PROFILE_KEEP)
+    profiles = []
+    for path in glob.glob(os.path.join(directory, PROFILE_PREFIX + "*.prof")):
+        try:
+            profiles.append((os.path.getmtime(path), path))
+        except OSError:
+            # Removed by another process
+            pass
+    profiles.sort()
+    for mtime, path in profiles[:max(len(profiles) - keep, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Already removed by another process
+            pass
+
+
+def _comment_tags(comment):
+    """
+    Return the ``(comment_id, content_type)`` tags for a comment instance.
+    """
+    content_type = comment.content_type
+    return comment.pk, "%s.%s" % (content_type.app_label, content_type.model)
+
+
+def profile_comment_view(view):
+    """
+    Decorator which profiles a comment view taking ``comment_id`` as its
+    first argument.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not should_profile(request):
+            return view(request, *args, **kwargs)
+
+        def get_tags():
+            comment_id = kwargs.get("comment_id", args[0] if args else None)
+            content_type = get_model().objects.filter(
+                pk=comment_id, site__pk=settings.SITE_ID).values_list(
+                "content_type__app_label", "content_type__model")[:1]
+            return comment_id, ".".join(content_type[0]) if content_type else None
+
+        return run_profiled(view.__name__, get_tags, view, request, *args, **kwargs)
+    return wrapper
+
+
+def profile_node_render(render):
+    """
+    Decorator which profiles the ``render`` method of a comment form node.
+    """
+    @wraps(render)
+    def wrapper(node, context):
+        if not should_profile(context.get("request")):
+            return render(node, context)
+
+        def get_tags():
+            return _comment_tags(node.get_object(context))
+
+        return run_profiled(node.__class__.__name__, get_tags, render, node, context)
+    return wrapper
@@ -4,15 +4,19 @@ from django.template.loader import render_to_string
 
 # Try to import django_comments otherwise fallback to the django contrib comments
 try:
+    from django_comments import get_model
     from django_comments.templatetags.comments import BaseCommentNode, CommentFormNode
 except ImportError:
     try:
+        from django.contrib.comments import get_model
         from django.contrib.comments.templatetags.comments import BaseCommentNode, CommentFormNode
     except ImportError:
         raise ImportError('django-comments-extension requires django-contrib-comments to be installed or the deprecated'
                           ' (as of django 1.6) django.contrib.comments.')
 
 import comments_extension
+from comments_extension.cache import comment_cache
+from comments_extension.profiling import profile_node_render
 
 
 register = template.Library()
@@ -22,12 +26,25 @@ class CommentEditFormNode(CommentFormNode):
     """
     Insert a form for the comment model into the context.
     """
+    def get_object(self, context):
+        if self.object_expr is None and self.ctype.model_class() is get_model():
+            object_pk = self.object_pk_expr.resolve(context, ignore_failures=True)
+            try:
+                return comment_cache.get(object_pk)
+            except get_model().DoesNotExist:
+                return None
+        return super(CommentEditFormNode, self).get_object(context)
+
     def get_form(self, context):
         obj = self.get_object(context)
         if obj:
             return comments_extension.get_edit_modelform(obj)
         else:
             return None
+
+    @profile_node_render
+    def render(self, context):
+        return super(CommentEditFormNode, self).render(context)
         
 
 class RenderCommentEditFormNode(CommentFormNode):
@@ -61,6 +78,7 @@ class RenderCommentEditFormNode(CommentFormNode):
             return None, None
         return obj.content_type, obj.pk
     
+    @profile_node_render
     def render(self, context):
         ctype, object_pk = self.get_target_ctype_pk(context)
         if object_pk:
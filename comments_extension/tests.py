@@ -5,7 +5,30 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.urlresolvers import reverse
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+# Try to import django_comments otherwise fallback to the django contrib comments
+try:
+    from django_comments import get_model
+except ImportError:
+    from django.contrib.comments import get_model
+
+from comments_extension import profiling
+from comments_extension.forms import CommentEditForm
+from comments_extension.cache import CommentObjectCache, comment_cache
+from comments_extension.diff import diff_comment, DIFF_DELETE, DIFF_INSERT
 
 
 class SimpleTest(TestCase):
@@ -14,3 +37,395 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class CommentDiffTest(TestCase):
+    """
+    Tests and worst-case benchmarks for ``comments_extension.diff``.
+    """
+    def assertDiffApplies(self, original, edited, diff):
+        self.assertEqual("".join(t for op, t in diff if op != DIFF_INSERT), original)
+        self.assertEqual("".join(t for op, t in diff if op != DIFF_DELETE), edited)
+
+    def test_word_diff(self):
+        diff = diff_comment("the quick brown fox", "the slow brown dog jumps")
+        self.assertEqual(diff, [
+            ("equal", "the "), ("delete", "quick"), ("insert", "slow"),
+            ("equal", " brown "), ("delete", "fox"), ("insert", "dog jumps")
+        ])
+        self.assertDiffApplies("the quick brown fox", "the slow brown dog jumps", diff)
+
+    def test_unchanged_and_empty(self):
+        self.assertEqual(diff_comment("same", "same"), [("equal", "same")])
+        self.assertEqual(diff_comment("", ""), [])
+        self.assertEqual(diff_comment("", "new"), [("insert", "new")])
+        self.assertEqual(diff_comment("old", ""), [("delete", "old")])
+
+    def test_size_budget(self):
+        self.assertEqual(diff_comment("a b c", "c b a", max_tokens=4), None)
+
+    def test_worst_case_exceeds_budget(self):
+        """
+        Texts of COMMENT_MAX_LENGTH characters with no words in common
+        maximise the edit distance. Unbounded this takes well over a second,
+        so the diff must give up and return None.
+        """
+        original, edited = " ".join(["a"] * 1500), " ".join(["b"] * 1500)
+        self.assertEqual(diff_comment(original, edited, timeout=0.05, max_tokens=10 ** 6), None)
+
+    def test_worst_case_within_budget(self):
+        """
+        Editing every 10th word of a text of COMMENT_MAX_LENGTH characters
+        gives hundreds of chunks, but the diff must still finish within
+        the default budget.
+        """
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit"]
+        original = " ".join(words[(i * 7 + i // 3) % len(words)] for i in range(500))[:3000]
+        edited = original.split(" ")
+        for i in range(0, len(edited), 10):
+            edited[i] = "edited"
+        edited = " ".join(edited)
+
+        diff = diff_comment(original, edited)
+        self.assertNotEqual(diff, None)
+        self.assertTrue(len(diff) > 50)
+        self.assertDiffApplies(original, edited, diff)
+
+    def test_size_budget_exceeded(self):
+        """
+        Input over the token budget is never diffed, however long the timeout.
+        """
+        original, edited = " ".join(["a"] * 1500), " ".join(["a", "b"] * 1500)
+        self.assertEqual(diff_comment(original, edited, timeout=100), None)
+
+
+class CommentTestMixin(object):
+    """
+    Creates a moderator and a comment on the current site.
+    """
+    def create_comment(self, text="original text", username="moderator"):
+        self.user = User.objects.create_superuser(username, "moderator@example.com", "secret")
+        self.client.login(username=username, password="secret")
+        return get_model().objects.create(
+            content_type=ContentType.objects.get_for_model(Site),
+            object_pk="1", site_id=1, user=self.user,
+            comment=text, submit_date=timezone.now()
+        )
+
+    def edit_data(self, comment, text, **extra):
+        """
+        POST data for editing ``comment``, including valid security data.
+        """
+        initial = CommentEditForm(instance=comment).initial
+        data = {
+            "user_name": "moderator",
+            "user_email": "moderator@example.com",
+            "comment": text,
+            "timestamp": initial["timestamp"],
+            "security_hash": initial["security_hash"],
+            "next": "/done/",
+        }
+        data.update(extra)
+        return data
+
+
+class FailingProfile(object):
+    """
+    Stands in for ``cProfile.Profile`` while another profiling tool is active.
+    """
+    def enable(self):
+        raise ValueError("Another profiling tool is already active")
+
+
+class ProfilingTest(CommentTestMixin, TestCase):
+    """
+    Tests for ``comments_extension.profiling``.
+    """
+    urls = "comments_extension.urls"
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.directory = os.path.join(self.root, "profiles")
+        self.profile_settings = override_settings(COMMENTS_EXTENSION_PROFILE_DIR=self.directory)
+        self.profile_settings.enable()
+
+    def tearDown(self):
+        self.profile_settings.disable()
+        shutil.rmtree(self.root)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    @override_settings(COMMENTS_EXTENSION_PROFILE_HEADER="HTTP_X_COMMENTS_PROFILE")
+    def test_profile_token(self):
+        factory = RequestFactory()
+        self.assertFalse(profiling.should_profile(factory.get("/")))
+        self.assertFalse(profiling.should_profile(
+            factory.get("/", HTTP_X_COMMENTS_PROFILE="profile:forged")))
+        self.assertTrue(profiling.should_profile(
+            factory.get("/", HTTP_X_COMMENTS_PROFILE=profiling.make_profile_token())))
+
+    def test_profile_rate(self):
+        with self.settings(COMMENTS_EXTENSION_PROFILE_RATE=0):
+            self.assertFalse(profiling.should_profile())
+        with self.settings(COMMENTS_EXTENSION_PROFILE_RATE=1):
+            self.assertTrue(profiling.should_profile())
+        with self.settings(COMMENTS_EXTENSION_PROFILE_RATE=1, COMMENTS_EXTENSION_PROFILE_DIR=None):
+            self.assertFalse(profiling.should_profile())
+
+    def test_run_profiled(self):
+        with self.settings(COMMENTS_EXTENSION_PROFILE_KEEP=2):
+            for i in range(3):
+                result = profiling.run_profiled("edit", lambda: (i, "tests.entry"), sum, [1, 2])
+                self.assertEqual(result, 3)
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertTrue(profiles[-1].startswith(profiling.PROFILE_PREFIX))
+        self.assertTrue("-edit-comment2-tests.entry-q0-" in profiles[-1])
+        # The directory is created private to the current user
+        self.assertEqual(os.stat(self.directory).st_mode & 0o777, 0o700)
+
+    def test_prune_own_profiles(self):
+        """
+        Only profiles written by this module are pruned.
+        """
+        os.makedirs(self.directory)
+        other = os.path.join(self.directory, "other-tool.prof")
+        open(other, "w").close()
+        with self.settings(COMMENTS_EXTENSION_PROFILE_KEEP=1):
+            for i in range(2):
+                profiling.run_profiled("edit", lambda: (i, None), sum, [1, 2])
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertTrue("other-tool.prof" in profiles)
+
+    def test_overlapping_profiles(self):
+        """
+        Calls overlapping a profiled call, or another profiling tool, run
+        without profiling instead of failing.
+        """
+        with profiling._profile_lock:
+            self.assertEqual(profiling.run_profiled("edit", lambda: (1, None), sum, [1, 2]), 3)
+
+        original_cProfile = profiling.cProfile
+        profiling.cProfile = type("cProfile", (object,), {"Profile": FailingProfile})
+        try:
+            self.assertEqual(profiling.run_profiled("edit", lambda: (1, None), sum, [1, 2]), 3)
+        finally:
+            profiling.cProfile = original_cProfile
+
+        # The lock is released again
+        profiling.run_profiled("edit", lambda: (1, None), sum, [1, 2])
+        self.assertEqual(len(self.profiles()), 1)
+
+    @override_settings(COMMENTS_EXTENSION_PROFILE_HEADER="HTTP_X_COMMENTS_PROFILE")
+    def test_profile_comment_view(self):
+        comment = self.create_comment()
+        response = self.client.post(
+            reverse("comments-edit", args=(comment.pk,)),
+            self.edit_data(comment, "edited text", preview="Preview"),
+            HTTP_X_COMMENTS_PROFILE=profiling.make_profile_token()
+        )
+        self.assertEqual(response.status_code, 200)
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 1)
+        tags = profiles[0][len(profiling.PROFILE_PREFIX):].split("-")
+        self.assertEqual(tags[1:4], ["edit", "comment%s" % comment.pk, "sites.site"])
+        # Queries are counted without the debug cursor
+        self.assertTrue(int(tags[4][1:]) > 0)
+
+    def test_nested_node_render(self):
+        """
+        Template tags rendered inside a profiled call don't start another profiler.
+        """
+        comment = self.create_comment()
+        template = Template(
+            "{% load comments_extension %}"
+            "{% get_comment_edit_form for comment_obj as form %}"
+            "{% render_comment_edit_form for comment_obj %}"
+        )
+        with self.settings(COMMENTS_EXTENSION_PROFILE_RATE=1):
+            template.render(Context({"comment_obj": comment}))
+            self.assertEqual(len(self.profiles()), 2)
+            profiling.run_profiled("outer", lambda: (comment.pk, None), template.render,
+                                   Context({"comment_obj": comment}))
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 3)
+        self.assertEqual(len([p for p in profiles if "-outer-" in p]), 1)
+
+
+class FakeComment(object):
+    def __init__(self, pk, comment):
+        self.pk = pk
+        self.comment = comment
+
+
+class CountingCommentObjectCache(CommentObjectCache):
+    """
+    Loads fake comments from a dict and counts the loads.
+    """
+    def __init__(self, comments):
+        super(CountingCommentObjectCache, self).__init__()
+        self.comments = comments
+        self.loads = 0
+
+    def load(self, pk, for_update=False):
+        self.loads += 1
+        return FakeComment(pk, self.comments[pk])
+
+    def same_row(self, comment, other):
+        return comment.comment == other.comment
+
+
+@override_settings(COMMENTS_EXTENSION_OBJECT_CACHE_SIZE=2)
+class CommentObjectCacheTest(TestCase):
+    """
+    Tests for ``comments_extension.cache.CommentObjectCache``.
+    """
+    def setUp(self):
+        self.cache = CountingCommentObjectCache({1: "first", 2: "second", 3: "third"})
+
+    def test_read_through(self):
+        comment = self.cache.get(1)
+        comment.comment = "changed in the view"
+        self.assertEqual(self.cache.get(1).comment, "first")
+        self.assertEqual(self.cache.loads, 1)
+
+    def test_invalidate(self):
+        comment = self.cache.get(1)
+        self.assertTrue(self.cache.is_current(comment))
+        self.cache.comments[1] = "edited"
+        self.cache.invalidate(1)
+        self.assertFalse(self.cache.is_current(comment))
+        self.assertEqual(self.cache.get(1).comment, "edited")
+        # is_current() compared with the database, as the stamp was dropped
+        self.assertEqual(self.cache.loads, 3)
+
+    def test_lru_eviction(self):
+        for pk in (1, 2, 1, 3, 1):
+            self.cache.get(pk)
+        self.assertEqual(self.cache.loads, 3)
+        self.cache.get(2)
+        self.assertEqual(self.cache.loads, 4)
+
+    def test_disabled(self):
+        with self.settings(COMMENTS_EXTENSION_OBJECT_CACHE_SIZE=0):
+            comment = self.cache.get(1)
+            self.cache.get(1)
+            self.cache.invalidate(1)
+        self.assertEqual(self.cache.loads, 2)
+        self.assertTrue(self.cache.is_current(comment))
+        self.assertEqual(len(self.cache._versions), 0)
+
+    def test_versions_bounded(self):
+        first = self.cache.get(1)
+        for pk in (1, 2, 3):
+            self.cache.get(pk)
+            self.cache.invalidate(pk)
+            self.cache.get(pk)
+        self.assertEqual(list(self.cache._versions), ["2", "3"])
+        # An evicted stamp doesn't make an unchanged comment stale
+        self.assertTrue(self.cache.is_current(first))
+
+
+@override_settings(COMMENTS_EXTENSION_OBJECT_CACHE_SIZE=10)
+class CommentCacheIntegrationTest(CommentTestMixin, TestCase):
+    """
+    Tests for ``comments_extension.cache`` against real comments.
+    """
+    urls = "comments_extension.urls"
+
+    def setUp(self):
+        comment_cache.clear()
+        self.comment = self.create_comment()
+
+    def tearDown(self):
+        comment_cache.clear()
+
+    def test_select_related(self):
+        comment_cache.get(self.comment.pk)
+        with self.assertNumQueries(0):
+            comment = comment_cache.get(self.comment.pk, site_id=1)
+            self.assertEqual(comment.content_type.model, "site")
+            self.assertEqual(comment.user.username, "moderator")
+
+    def test_site_checked(self):
+        self.assertRaises(get_model().DoesNotExist, comment_cache.get, self.comment.pk, 2)
+
+    def test_save_invalidates(self):
+        cached = comment_cache.get(self.comment.pk)
+        self.comment.comment = "saved elsewhere"
+        self.comment.save()
+        self.assertFalse(comment_cache.is_current(cached))
+        self.assertEqual(comment_cache.get(self.comment.pk).comment, "saved elsewhere")
+
+    def test_delete_invalidates(self):
+        comment_cache.get(self.comment.pk)
+        self.comment.delete()
+        self.assertRaises(get_model().DoesNotExist, comment_cache.get, self.comment.pk)
+
+    @override_settings(
+        COMMENTS_EXTENSION_OBJECT_CACHE_ALIAS="comments",
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "comments": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                         "LOCATION": "comments_extension.tests"},
+        }
+    )
+    def test_shared_cache(self):
+        # Another process, with its own in-process LRU
+        other_cache = CommentObjectCache()
+        cached = comment_cache.get(self.comment.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(other_cache.get(self.comment.pk).comment, "original text")
+        self.assertTrue(other_cache.is_current(cached))
+
+        self.comment.comment = "saved elsewhere"
+        self.comment.save()
+        self.assertFalse(other_cache.is_current(cached))
+        self.assertEqual(other_cache.get(self.comment.pk).comment, "saved elsewhere")
+        self.assertEqual(comment_cache.get_version(self.comment.pk),
+                         other_cache.get_version(self.comment.pk))
+        comment_cache.shared.clear()
+
+    def test_edit_saves(self):
+        response = self.client.post(reverse("comments-edit", args=(self.comment.pk,)),
+                                    self.edit_data(self.comment, "edited text"))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(get_model().objects.get(pk=self.comment.pk).comment, "edited text")
+
+    def test_evicted_stamp_is_not_a_change(self):
+        with self.settings(COMMENTS_EXTENSION_OBJECT_CACHE_SIZE=2):
+            others = [self.create_comment(username="moderator%d" % i) for i in range(2)]
+            cached = comment_cache.get(self.comment.pk)
+            for comment in others:
+                comment_cache.get(comment.pk)
+            self.assertTrue(comment_cache.is_current(cached))
+
+            # Changed without signals, only the database knows
+            get_model().objects.filter(pk=self.comment.pk).update(comment="updated elsewhere")
+            self.assertFalse(comment_cache.is_current(cached))
+
+    def test_edit_saves_database_row(self):
+        """
+        Saving never writes back a stale cached copy of the comment.
+        """
+        comment_cache.get(self.comment.pk)
+        # Changed without signals, so the cached copy is stale
+        get_model().objects.filter(pk=self.comment.pk).update(is_public=False)
+
+        response = self.client.post(reverse("comments-edit", args=(self.comment.pk,)),
+                                    self.edit_data(self.comment, "edited text"))
+        self.assertEqual(response.status_code, 302)
+        comment = get_model().objects.get(pk=self.comment.pk)
+        self.assertEqual(comment.comment, "edited text")
+        self.assertFalse(comment.is_public)
+
+    def test_edit_preview_reads_cache(self):
+        comment_cache.get(self.comment.pk)
+        get_model().objects.filter(pk=self.comment.pk).update(comment="updated elsewhere")
+        response = self.client.post(reverse("comments-edit", args=(self.comment.pk,)),
+                                    self.edit_data(self.comment, "edited text", preview="Preview"))
+        self.assertEqual(response.status_code, 200)
+        # The diff is taken against the cached copy
+        self.assertTrue(("delete", "original") in response.context["diff"])
@@ -4,7 +4,8 @@ from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest
 from django.utils.html import escape
 from django.contrib.auth.decorators import user_passes_test
-from django.shortcuts import get_object_or_404, render_to_response
+from django.db import transaction
+from django.shortcuts import render_to_response
 from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.http import require_POST
 from django.template.loader import render_to_string
@@ -12,13 +13,11 @@ from django.template.context import RequestContext
 
 # Try to import django_comments otherwise fallback to the django contrib comments
 try:
-    from django_comments import get_model
     from django_comments.models import CommentFlag
     from django_comments.signals import comment_was_flagged
     from django_comments.views import utils
 except ImportError:
     try:
-        from django.contrib.comments import get_model
         from django.contrib.comments.models import CommentFlag
         from django.contrib.comments.signals import comment_was_flagged
         from django.contrib.comments.views import utils
@@ -27,6 +26,9 @@ except ImportError:
                           ' (as of django 1.6) django.contrib.comments.')
 
 import comments_extension
+from comments_extension.cache import get_comment_or_404
+from comments_extension.diff import diff_comment
+from comments_extension.profiling import profile_comment_view
 
 
 class CommentEditBadRequest(HttpResponseBadRequest):
@@ -45,6 +47,8 @@ class CommentEditBadRequest(HttpResponseBadRequest):
 @require_POST
 @user_passes_test(lambda u: u.has_perm("comments.change_comment")
                   or u.has_perm("comment.can_moderate"))
+@profile_comment_view
+@transaction.atomic
 def edit(request, comment_id, next=None):
     """
     Edit a comment.
@@ -60,10 +64,15 @@ def edit(request, comment_id, next=None):
     Context:
         comment
             the `comments.comment` object to be edited.
+        diff
+            list of ``(op, text)`` chunks between the original and the
+            edited comment text, or ``None`` if the form has errors or the
+            diff was too expensive.
     """
-    comment = get_object_or_404(
-        get_model(), pk=comment_id, site__pk=settings.SITE_ID
-    )
+    # The comment object cache is only used for previews. A comment which
+    # is about to be saved is always read, and locked, from the database.
+    comment = get_comment_or_404(comment_id, site_id=settings.SITE_ID,
+                                 for_update="preview" not in request.POST)
     
     # Make sure user has correct permissions to change the comment,
     # or return a 401 Unauthorized error.
@@ -80,6 +89,8 @@ def edit(request, comment_id, next=None):
         data["user_email"] = request.user.email
     
     next = data.get("next", next)
+    # Keep the original text, as validating the form updates the instance
+    original = comment.comment
     CommentEditForm = comments_extension.get_edit_form()
     form = CommentEditForm(data, instance=comment)
 
@@ -101,6 +112,7 @@ def edit(request, comment_id, next=None):
             template_search_list, {
                 "comment_obj": comment,
                 "comment": form.data.get("comment", ""),
+                "diff": None if form.errors else diff_comment(original, form.data.get("comment", "")),
                 "form": form,
                 "next": next,
             },